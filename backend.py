@@ -1,21 +1,81 @@
 from flask import Flask, request, jsonify
-import os, hashlib, base64
+from flask.json.provider import DefaultJSONProvider
+import os, hashlib, hmac, base64, functools, logging, logging.handlers, queue, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+import orjson
+import requests
 import stripe
-import psycopg2
+from psycopg2 import InterfaceError, OperationalError
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+
+# orjson for request parsing and jsonify(); datetimes still go through Flask's
+# default so response formats are unchanged.
+class ORJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+# Werkzeug enforces this while reading, so chunked bodies without a
+# Content-Length are capped too (413); every endpoint takes small JSON.
+app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024
+
+# --- LOGGING ---
+# Request threads only enqueue records; a listener thread does the stdout writes.
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+
+log = logging.getLogger("backend")
+log.addHandler(logging.handlers.QueueHandler(_log_queue))
+log.setLevel(logging.INFO)
+log.propagate = False
 
 # --- ENV ---
 if not os.getenv("RENDER"):
     raise RuntimeError("Must run on Render")
 
+REQUIRED_ENV = (
+    "STRIPE_SECRET_KEY_LIVE",
+    "STRIPE_WEBHOOK_SECRET",
+    "LICENSE_SECRET",
+    "SUCCESS_URL",
+    "CANCEL_URL",
+)
+_missing_env = [name for name in REQUIRED_ENV if not os.getenv(name)]
+if _missing_env:
+    raise RuntimeError(f"Missing environment variables: {', '.join(_missing_env)}")
+
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY_LIVE")
+# Keep-alive connection pool to api.stripe.com shared by all requests.
+_stripe_session = requests.Session()
+_stripe_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=0))
+stripe.default_http_client = stripe.RequestsClient(timeout=10, session=_stripe_session)
+stripe.max_network_retries = 2
 WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 LICENSE_SECRET = os.getenv("LICENSE_SECRET")
+LICENSE_SCHEME = os.getenv("LICENSE_SCHEME", "v1")
+if LICENSE_SCHEME not in ("v1", "v2"):
+    raise RuntimeError(f"Unknown LICENSE_SCHEME '{LICENSE_SCHEME}'")
 BILLING_PORTAL_RETURN_URL = os.getenv("BILLING_PORTAL_RETURN_URL")
 BILLING_PORTAL_CONFIG_ID = os.getenv("BILLING_PORTAL_CONFIG_ID")
+SUCCESS_URL = os.getenv("SUCCESS_URL")
+CANCEL_URL = os.getenv("CANCEL_URL")
+
+TIERS = ("pro", "diamond")
+TIER_PRICE_IDS = {t: os.getenv(f"PRICE_{t.upper()}_ID") for t in TIERS}
+VALID_TIERS = frozenset(t for t, price in TIER_PRICE_IDS.items() if price)
+if not VALID_TIERS:
+    raise RuntimeError("No PRICE_<TIER>_ID configured for any tier")
 
 # --- DATABASE ---
 DB_HOST = os.getenv("DB_HOST")
@@ -24,125 +84,353 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
+# Per gunicorn worker. Must cover the worker's threads, since getconn() raises
+# instead of blocking when the pool is exhausted, and keep
+# workers × DB_POOL_MAX ≤ Postgres max_connections (minus other clients).
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 20))
+# psycopg2 keeps at most minconn idle connections and closes any returned
+# beyond that, so this is the reuse cap as well as the number opened up front.
+DB_POOL_IDLE = min(int(os.getenv("DB_POOL_IDLE", DB_POOL_MAX)), DB_POOL_MAX)
+
+# Built on first use in each worker, never at import, so the master process
+# holds no sockets. Tables and indexes come from migrate.py, which gunicorn's
+# on_starting hook applies.
+REQUIRED_TABLES = ("users", "processed_events", "pending_checkouts")
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                pool = ThreadedConnectionPool(
+                    DB_POOL_IDLE,
+                    DB_POOL_MAX,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASS
+                )
+                _check_schema(pool)
+                _db_pool = pool
+    return _db_pool
+
+# Skipped migration → one clear error instead of a 500 from every query.
+# The pool is not kept, so the check reruns once migrate.py has been applied.
+def _check_schema(pool):
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT t FROM unnest(%s::text[]) AS t WHERE to_regclass(t) IS NULL",
+                (list(REQUIRED_TABLES),)
+            )
+            missing = [row[0] for row in cur.fetchall()]
+        conn.rollback()
+    finally:
+        pool.putconn(conn)
+    if missing:
+        pool.closeall()
+        raise RuntimeError(f"Missing tables: {', '.join(missing)} (run python migrate.py)")
+
+# Returned connections idle longer than this are pinged before reuse, so ones
+# killed by a Postgres restart or an idle timeout are replaced instead of
+# failing a request. Freshly opened connections have no entry and skip the ping.
+DB_IDLE_CHECK_SECS = 5
+_conn_last_used = {}
+
+def checkout_connection():
+    pool = _get_pool()
+    # After a restart every pooled connection may be dead; the pool opens a
+    # fresh one once the stale ones have been discarded.
+    for _ in range(DB_POOL_MAX + 1):
+        conn = pool.getconn()
+        last_used = _conn_last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < DB_IDLE_CHECK_SECS:
+            return conn
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return conn
+        except (OperationalError, InterfaceError):
+            _conn_last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+    raise OperationalError("no usable database connection")
+
+@contextmanager
 def get_db_connection():
-    return psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS
-    )
+    conn = checkout_connection()
+    broken = False
+    try:
+        yield conn
+    except (OperationalError, InterfaceError):
+        broken = True
+        raise
+    finally:
+        # putconn() rolls back anything uncommitted; broken connections are dropped
+        broken = broken or bool(conn.closed)
+        _conn_last_used[id(conn)] = time.monotonic()
+        _get_pool().putconn(conn, close=broken)
+        # Closed here or by the pool (over the idle cap) → forget it while we
+        # still hold the object, so a new connection cannot inherit its id
+        if conn.closed:
+            _conn_last_used.pop(id(conn), None)
 
 # --- USERS STORAGE ---
+# Per-process read cache: rows (including misses) are kept for USER_CACHE_TTL
+# seconds and dropped on every write, so other workers see changes within the TTL.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 5))
+USER_CACHE_MAX = 10000
+_user_cache = {}
+_user_cache_lock = threading.RLock()
+# Bumped by every invalidation; a read only caches its result if the
+# generation it started under is still current, so a query that began before
+# a write cannot put the old row back. Clearing the map bumps the epoch.
+_user_gen = {}
+_user_gen_epoch = 0
+
+def user_generation(username):
+    with _user_cache_lock:
+        return _user_gen_epoch, _user_gen.get(username, 0)
+
+def invalidate_user(username):
+    global _user_gen_epoch
+    with _user_cache_lock:
+        _user_cache.pop(username, None)
+        _status_cache.pop(username, None)
+        if len(_user_gen) >= USER_CACHE_MAX:
+            _user_gen.clear()
+            _user_gen_epoch += 1
+        _user_gen[username] = _user_gen.get(username, 0) + 1
+
 def load_user(username):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
+    now = time.monotonic()
+    with _user_cache_lock:
+        hit = _user_cache.get(username)
+        gen = user_generation(username)
+    if hit and hit[0] > now:
+        return hit[1]
+
+    with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            "SELECT tier, license_key, expires, cancel_at, customer_id FROM users WHERE username = %s",
+            (username,)
+        )
+        user = cur.fetchone()
+
+    with _user_cache_lock:
+        if user_generation(username) == gen:
+            if len(_user_cache) >= USER_CACHE_MAX:
+                _user_cache.clear()
+            _user_cache[username] = (now + USER_CACHE_TTL, user)
     return user
 
-def load_all_users():
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM users")
-    users = cur.fetchall()
-    cur.close()
-    conn.close()
-    return users
+def load_user_by_subscription(sub_id):
+    with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT username, tier FROM users WHERE subscription_id = %s LIMIT 1", (sub_id,))
+        return cur.fetchone()
+
+def update_by_subscription(sub_id, **fields):
+    cols = ", ".join(f"{name} = %s" for name in fields)
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"UPDATE users SET {cols} WHERE subscription_id = %s RETURNING username",
+                (*fields.values(), sub_id)
+            )
+            usernames = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    for username in usernames:
+        invalidate_user(username)
+    return usernames
 
 def upsert_user(user):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO users (username, tier, license_key, expires, customer_id, subscription_id, cancel_at, pending_checkout, pending_tier)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (username)
-        DO UPDATE SET
-            tier = EXCLUDED.tier,
-            license_key = EXCLUDED.license_key,
-            expires = EXCLUDED.expires,
-            customer_id = EXCLUDED.customer_id,
-            subscription_id = EXCLUDED.subscription_id,
-            cancel_at = EXCLUDED.cancel_at,
-            pending_checkout = EXCLUDED.pending_checkout,
-            pending_tier = EXCLUDED.pending_tier
-    """, (
-        user.get("username"),
-        user.get("tier", "free"),
-        user.get("license_key"),
-        user.get("expires"),
-        user.get("customer_id"),
-        user.get("subscription_id"),
-        user.get("cancel_at"),
-        user.get("pending_checkout"),
-        user.get("pending_tier")
-    ))
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO users (username, tier, license_key, expires, customer_id, subscription_id, cancel_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (username)
+                DO UPDATE SET
+                    tier = EXCLUDED.tier,
+                    license_key = EXCLUDED.license_key,
+                    expires = EXCLUDED.expires,
+                    customer_id = EXCLUDED.customer_id,
+                    subscription_id = EXCLUDED.subscription_id,
+                    cancel_at = EXCLUDED.cancel_at
+            """, (
+                user.get("username"),
+                user.get("tier", "free"),
+                user.get("license_key"),
+                user.get("expires"),
+                user.get("customer_id"),
+                user.get("subscription_id"),
+                user.get("cancel_at")
+            ))
+        conn.commit()
+    invalidate_user(user.get("username"))
+
+# --- PENDING CHECKOUTS ---
+PENDING_CHECKOUT_DAYS = 7
+
+def add_pending_checkout(session_id, username, tier):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO pending_checkouts (session_id, username, tier) VALUES (%s, %s, %s)",
+                (session_id, username, tier)
+            )
+            # Sessions that were never completed
+            cur.execute(
+                "DELETE FROM pending_checkouts WHERE created_at < NOW() - make_interval(days => %s)",
+                (PENDING_CHECKOUT_DAYS,)
+            )
+        conn.commit()
+
+def load_pending_checkout(session_id):
+    with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT username, tier FROM pending_checkouts WHERE session_id = %s", (session_id,))
+        return cur.fetchone()
+
+def pop_pending_checkout(session_id):
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                "DELETE FROM pending_checkouts WHERE session_id = %s RETURNING username, tier",
+                (session_id,)
+            )
+            row = cur.fetchone()
+        conn.commit()
+    return row
 
 # --- LICENSE ---
+# Keys are base64 of:
+#   v1  "tier|exp|sha256(tier|exp|secret)"          — what deployed clients verify
+#   v2  "v2|tier|exp|hmac_sha256(secret, tier|exp)"
+# Issue v2 (LICENSE_SCHEME=v2) only once clients accept both: a leading "v2"
+# field selects HMAC, anything else is checked as v1.
+_LICENSE_SUFFIX = f"|{LICENSE_SECRET}".encode()
+_LICENSE_HMAC = hmac.new(LICENSE_SECRET.encode(), digestmod=hashlib.sha256)
+_TIER_PREFIX = {t: f"{t}|".encode() for t in TIERS}
+
+def yyyymmdd(dt):
+    return f"{dt.year:04d}{dt.month:02d}{dt.day:02d}"
+
+# Deterministic for a (tier, expiry) pair, so retried webhooks on the same
+# day reuse the key instead of re-signing.
+@functools.lru_cache(maxsize=1024)
+def sign_license(tier, exp):
+    msg = (_TIER_PREFIX.get(tier) or f"{tier}|".encode()) + exp.encode()
+    if LICENSE_SCHEME == "v2":
+        h = _LICENSE_HMAC.copy()
+        h.update(msg)
+        raw = b"v2|" + msg + b"|" + h.hexdigest().encode()
+    else:
+        raw = msg + b"|" + hashlib.sha256(msg + _LICENSE_SUFFIX).hexdigest().encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
 def gen_license(tier):
-    exp = (datetime.utcnow() + timedelta(days=30)).strftime("%Y%m%d")
-    sig = hashlib.sha256(f"{tier}|{exp}|{LICENSE_SECRET}".encode()).hexdigest()
-    lic = base64.urlsafe_b64encode(f"{tier}|{exp}|{sig}".encode()).decode()
-    return lic, exp
+    exp = yyyymmdd(datetime.utcnow() + timedelta(days=30))
+    return sign_license(tier, exp), exp
 
 # --- CHECKOUT ---
 @app.route("/create_checkout_session", methods=["POST"])
 def create_checkout():
-    data = request.json
+    data = request.get_json(silent=True, cache=False)
+    if not isinstance(data, dict):
+        data = {}
     username = data.get("username")
     tier = data.get("tier")
 
-    if not username or not tier:
+    if not username or not tier or not isinstance(username, str) or not isinstance(tier, str):
         return jsonify({"error": "Missing"}), 400
 
-    price_id = os.getenv(f"PRICE_{tier.upper()}_ID")
+    tier = tier.lower()
+    if tier not in VALID_TIERS:
+        return jsonify({"error": f"Invalid or unset tier '{tier}'"}), 400
+    price_id = TIER_PRICE_IDS[tier]
 
-    session = stripe.checkout.Session.create(
-        mode="subscription",
-        line_items=[{"price": price_id, "quantity": 1}],
-        success_url=os.getenv("SUCCESS_URL"),
-        cancel_url=os.getenv("CANCEL_URL"),
-        metadata={"username": username, "tier": tier}
-    )
+    try:
+        session = stripe.checkout.Session.create(
+            mode="subscription",
+            line_items=[{"price": price_id, "quantity": 1}],
+            success_url=SUCCESS_URL,
+            cancel_url=CANCEL_URL,
+            metadata={"username": username, "tier": tier}
+        )
+    except stripe.StripeError:
+        log.exception("stripe create_checkout failed for %s", username)
+        return jsonify({"error": "checkout_failed"}), 500
 
     # Store pending checkout in DB
-    upsert_user({
-        "username": username,
-        "tier": tier,
-        "license_key": None,
-        "expires": None,
-        "customer_id": None,
-        "subscription_id": None,
-        "cancel_at": None,
-        "pending_checkout": session.id,
-        "pending_tier": tier
-    })
+    add_pending_checkout(session.id, username, tier)
 
     return jsonify({"checkout_url": session.url})
 
 # --- WEBHOOK ---
-@app.route("/webhook", methods=["POST"])
-def webhook():
-    payload = request.data
-    sig = request.headers.get("stripe-signature")
-
-    try:
-        event = stripe.Webhook.construct_event(payload, sig, WEBHOOK_SECRET)
-    except:
-        return "Invalid signature", 400
-
+PAYMENT_EVENTS = frozenset({"checkout.session.completed", "invoice.payment_succeeded"})
+SUBSCRIPTION_EVENTS = frozenset({"customer.subscription.updated", "customer.subscription.deleted"})
+HANDLED_EVENTS = PAYMENT_EVENTS | SUBSCRIPTION_EVENTS
+ENDED_STATUSES = frozenset({"canceled", "unpaid", "incomplete_expired"})
+PROCESSED_EVENTS_MAX = 10000
+# Stripe stops retrying after 3 days; older ids can never come back
+PROCESSED_EVENT_DAYS = 30
+
+_processed_events = OrderedDict()
+_processed_lock = threading.Lock()
+
+# processed_events is the source of truth shared by all workers; the local
+# OrderedDict only saves a round-trip for ids this worker has already seen.
+def record_event(event_id):
+    with _processed_lock:
+        if event_id in _processed_events:
+            return
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            # Losing this row in a crash only means a redelivery gets processed
+            # again, which the handlers tolerate, so skip the WAL flush wait.
+            cur.execute("SET LOCAL synchronous_commit = off")
+            cur.execute(
+                "INSERT INTO processed_events (event_id) VALUES (%s) ON CONFLICT DO NOTHING",
+                (event_id,)
+            )
+            cur.execute(
+                "DELETE FROM processed_events WHERE processed_at < NOW() - make_interval(days => %s)",
+                (PROCESSED_EVENT_DAYS,)
+            )
+        conn.commit()
+
+    with _processed_lock:
+        _processed_events[event_id] = None
+        if len(_processed_events) > PROCESSED_EVENTS_MAX:
+            _processed_events.popitem(last=False)
+
+def event_seen(event_id):
+    with _processed_lock:
+        if event_id in _processed_events:
+            return True
+    with get_db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM processed_events WHERE event_id = %s", (event_id,))
+        return cur.fetchone() is not None
+
+def handle_event(event):
     et = event["type"]
     obj = event["data"]["object"]
 
     # ✅ PAYMENT CONFIRMED — ACTIVATE SUBSCRIPTION
     if et == "checkout.session.completed":
-        username = obj["metadata"].get("username")
-        tier = obj["metadata"].get("tier")
+        metadata = obj.get("metadata") or {}
+        username = metadata.get("username")
+        tier = metadata.get("tier")
+        # Session without our metadata → fall back to the pending checkout row
+        if not username or not tier:
+            pending = load_pending_checkout(obj["id"])
+            if pending:
+                username, tier = pending["username"], pending["tier"]
         if username and tier:
             lic, exp = gen_license(tier)
             upsert_user({
@@ -152,88 +440,170 @@ def webhook():
                 "expires": exp,
                 "customer_id": obj["customer"],
                 "subscription_id": obj["subscription"],
-                "cancel_at": None,
-                "pending_checkout": None,
-                "pending_tier": None
+                "cancel_at": None
             })
+            # Only once the activation is stored, so a retried event can still resolve it
+            pop_pending_checkout(obj["id"])
+        else:
+            log.warning("checkout %s has no matching user", obj["id"])
 
     # 🔁 MONTHLY RENEWAL
     if et == "invoice.payment_succeeded":
         sub_id = obj.get("subscription")
-        users = load_all_users()
-        for info in users:
-            if info.get("subscription_id") == sub_id:
-                lic, exp = gen_license(info["tier"])
-                upsert_user({
-                    **info,
-                    "license_key": lic,
-                    "expires": exp
-                })
-                break
+        info = load_user_by_subscription(sub_id) if sub_id else None
+        if info:
+            lic, exp = gen_license(info["tier"])
+            update_by_subscription(sub_id, license_key=lic, expires=exp)
+        else:
+            log.info("renewal for unknown subscription %s", sub_id)
 
     # ❌ CANCELLATION (END OF PERIOD)
-    if et in ("customer.subscription.updated", "customer.subscription.deleted"):
+    if et in SUBSCRIPTION_EVENTS:
         sub_id = obj["id"]
         status = obj["status"]
-        if status in ("canceled", "unpaid", "incomplete_expired"):
-            users = load_all_users()
-            for info in users:
-                if info.get("subscription_id") == sub_id:
-                    cancel_at = obj.get("current_period_end")
-                    upsert_user({
-                        **info,
-                        "cancel_at": datetime.utcfromtimestamp(cancel_at) if cancel_at else None
-                    })
-                    break
+        if status in ENDED_STATUSES:
+            cancel_at = obj.get("current_period_end")
+            update_by_subscription(
+                sub_id,
+                cancel_at=datetime.utcfromtimestamp(cancel_at) if cancel_at else None
+            )
+
+@app.route("/webhook", methods=["POST"])
+def webhook():
+    sig = request.headers.get("stripe-signature")
+
+    # Cheap reject before reading or hashing the body
+    if not sig or "t=" not in sig or "v1=" not in sig:
+        return "Invalid signature", 400
 
+    payload = request.get_data(cache=False)
+
+    # Parse straight to dicts; only id/type/data.object are used
+    try:
+        event = orjson.loads(payload)
+    except orjson.JSONDecodeError:
+        return "Invalid payload", 400
+    if not isinstance(event, dict) or not isinstance(event.get("id"), str):
+        return "Invalid payload", 400
+
+    # Redelivery of an id this worker already recorded → ack before the HMAC.
+    # Nothing is written for it, so a forged id gains nothing.
+    with _processed_lock:
+        if event.get("id") in _processed_events:
+            return "", 200
+
+    try:
+        # str, as construct_event() passed it; not every SDK release decodes bytes
+        stripe.WebhookSignature.verify_header(
+            payload.decode("utf-8"), sig, WEBHOOK_SECRET, tolerance=stripe.Webhook.DEFAULT_TOLERANCE
+        )
+    except Exception:
+        log.warning("webhook rejected: invalid signature")
+        return "Invalid signature", 400
+
+    # Nothing to apply → ack without touching the database
+    if event.get("type") not in HANDLED_EVENTS:
+        return "", 200
+
+    # Never ack an event before it is applied; a 500 makes Stripe retry.
+    # The id is recorded only after success, so a failure never blocks the retry;
+    # a concurrent duplicate re-applies the same update, which is harmless.
+    if event_seen(event["id"]):
+        return "", 200
+    try:
+        handle_event(event)
+    except Exception:
+        log.exception("webhook %s (%s) failed", event["id"], event["type"])
+        return "Processing failed", 500
+    record_event(event["id"])
     return "", 200
 
 # --- STATUS ---
-@app.route("/get_status", methods=["GET"])
-def get_status():
-    username = request.args.get("user")
-    user = load_user(username)
+# Rendered /get_status bodies, kept for STATUS_CACHE_TTL seconds so clients
+# polling in a tight loop skip the expiry check and JSON encoding.
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", 1))
+_status_cache = {}
 
+def status_payload(user):
     # No record → FREE
     if not user:
-        return jsonify({"tier": "free"})
+        return {"tier": "free"}
 
     # Incomplete / pending / corrupted → FREE
     if "tier" not in user or "license_key" not in user or "expires" not in user:
-        return jsonify({"tier": "free"})
+        return {"tier": "free"}
 
-    # Expiry check
-    try:
-        exp_dt = datetime.strptime(user["expires"], "%Y%m%d")
-        if datetime.utcnow() > exp_dt:
-            return jsonify({"tier": "free"})
-    except Exception:
-        return jsonify({"tier": "free"})
+    # Expiry check — YYYYMMDD strings sort like dates; expires at 00:00 UTC that day.
+    # Anything not exactly eight digits is malformed → FREE
+    expires = user["expires"]
+    if (not isinstance(expires, str) or len(expires) != 8 or not expires.isdigit()
+            or expires <= yyyymmdd(datetime.utcnow())):
+        return {"tier": "free"}
 
-    return jsonify({
+    return {
         "tier": user["tier"],
         "license_key": user["license_key"],
         "expires": user["expires"],
         "cancel_at": user.get("cancel_at")
-    })
+    }
+
+@app.route("/get_status", methods=["GET"])
+def get_status():
+    username = request.args.get("user")
+    now = time.monotonic()
+    with _user_cache_lock:
+        hit = _status_cache.get(username)
+        gen = user_generation(username)
+    if hit and hit[0] > now:
+        _, body, etag = hit
+    else:
+        body = jsonify(status_payload(load_user(username))).get_data()
+        etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+        with _user_cache_lock:
+            # Written meanwhile → serve this body but don't keep it
+            if user_generation(username) == gen:
+                if len(_status_cache) >= USER_CACHE_MAX:
+                    _status_cache.clear()
+                _status_cache[username] = (now + STATUS_CACHE_TTL, body, etag)
+
+    # Unchanged since the client's last poll → 304, no body
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(body, mimetype="application/json")
+    resp.set_etag(etag)
+    return resp
 
 # --- CANCEL SUBSCRIPTION ---
 @app.route("/cancel_subscription", methods=["POST"])
 def cancel_subscription():
-    username = request.json.get("username")
-    user = load_user(username)
+    data = request.get_json(silent=True, cache=False)
+    username = data.get("username") if isinstance(data, dict) else None
+    user = load_user(username) if isinstance(username, str) else None
 
     if not user or not user.get("customer_id"):
         return jsonify({"error": "No active subscription"}), 400
 
-    portal = stripe.billing_portal.Session.create(
-        customer=user["customer_id"],
-        configuration=BILLING_PORTAL_CONFIG_ID,
-        return_url=BILLING_PORTAL_RETURN_URL
-    )
+    try:
+        portal = stripe.billing_portal.Session.create(
+            customer=user["customer_id"],
+            configuration=BILLING_PORTAL_CONFIG_ID,
+            return_url=BILLING_PORTAL_RETURN_URL
+        )
+    except stripe.StripeError:
+        log.exception("stripe billing portal failed for %s", username)
+        return jsonify({"error": "portal_failed"}), 500
 
     return jsonify({"portal_url": portal.url})
 
+# --- HEALTH ---
+# Built once: everything it reports is fixed at startup.
+_HEALTH_BODY = app.json.dumps({"status": "ok", "tiers": sorted(VALID_TIERS)})
+
+@app.route("/health", methods=["GET"])
+def health():
+    return app.response_class(_HEALTH_BODY, mimetype="application/json")
+
 # --- RUN ---
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=False)
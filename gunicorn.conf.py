@@ -0,0 +1,29 @@
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+# Explicit, not derived from the CPU count: containers report the host's CPUs,
+# and every worker holds its own DB pool (see DB_POOL_MAX in backend.py).
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+
+# psycopg2 and the Stripe SDK block in C/socket calls, so use real threads
+# rather than gevent greenlets.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+timeout = 30
+accesslog = "-"
+
+# Render's proxy reuses upstream connections; keep them open between requests
+# instead of gunicorn's 2s default.
+keepalive = 75
+
+# SO_REUSEPORT on the listener. No preload_app: the DB pool and log listener
+# must be created in each worker, not inherited over fork.
+reuse_port = True
+
+# Apply migrate.py in the master before any worker boots, so a deploy never
+# serves without its tables; every statement is a no-op once applied.
+def on_starting(server):
+    import migrate
+    migrate.migrate()
@@ -0,0 +1,57 @@
+# Schema setup for the tables and indexes backend.py relies on. gunicorn
+# runs it on start (see gunicorn.conf.py); it can also be run by hand:
+#     python migrate.py
+import os
+import psycopg2
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS processed_events (
+        event_id TEXT PRIMARY KEY,
+        processed_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )""",
+    """CREATE TABLE IF NOT EXISTS pending_checkouts (
+        session_id TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        tier TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )""",
+    "CREATE INDEX IF NOT EXISTS processed_events_processed_at_idx ON processed_events (processed_at)",
+)
+
+# CONCURRENTLY so building on a live users table does not block writes
+CONCURRENT_INDEXES = {
+    "users_subscription_id_idx": "CREATE INDEX CONCURRENTLY IF NOT EXISTS users_subscription_id_idx ON users (subscription_id)",
+}
+
+# A failed CONCURRENTLY build leaves an INVALID index behind, which
+# IF NOT EXISTS would then skip forever; those are dropped and rebuilt.
+INVALID_INDEXES = """
+    SELECT c.relname FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE NOT i.indisvalid AND c.relname = ANY(%s) AND pg_table_is_visible(c.oid)
+"""
+
+def migrate():
+    conn = psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 5432)),
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS")
+    )
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    conn.autocommit = True
+    cur = conn.cursor()
+    for stmt in SCHEMA:
+        cur.execute(stmt)
+    cur.execute(INVALID_INDEXES, (list(CONCURRENT_INDEXES),))
+    for (name,) in cur.fetchall():
+        print(f"rebuilding invalid index {name}")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    for stmt in CONCURRENT_INDEXES.values():
+        cur.execute(stmt)
+    cur.close()
+    conn.close()
+
+if __name__ == "__main__":
+    migrate()
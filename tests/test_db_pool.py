@@ -0,0 +1,73 @@
+import os
+
+for name in ("RENDER", "STRIPE_SECRET_KEY_LIVE", "STRIPE_WEBHOOK_SECRET", "LICENSE_SECRET",
+             "SUCCESS_URL", "CANCEL_URL", "PRICE_PRO_ID"):
+    os.environ.setdefault(name, "test")
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import backend
+
+
+class FakeCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return []
+
+
+class FakeConn:
+    closed = 0
+
+    def __init__(self):
+        self.info = self
+
+    @property
+    def transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.transaction_status
+
+    def cursor(self, **kwargs):
+        return FakeCursor()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    conns = []
+
+    def connect(*args, **kwargs):
+        conns.append(FakeConn())
+        return conns[-1]
+
+    monkeypatch.setattr(psycopg2, "connect", connect)
+    monkeypatch.setattr(backend, "_db_pool", None)
+    monkeypatch.setattr(backend, "_conn_last_used", {})
+    return conns
+
+
+def test_sequential_checkouts_reuse_the_connection(opened):
+    with backend.get_db_connection() as first:
+        pass
+    with backend.get_db_connection() as second:
+        pass
+
+    assert second is first
+    assert not first.closed
+    assert len(opened) == backend.DB_POOL_IDLE